@@ -7,9 +7,39 @@
 - 输出转义检查
 """
 
+import logging
+import re
+
 from django.conf import settings
 from django.utils.deprecation import MiddlewareMixin
 
+from apps.utils.xss_protection import regex_engine
+
+
+logger = logging.getLogger('security')
+
+# 常见的XSS攻击模式
+XSS_PATTERNS = [
+    '<script',
+    'javascript:',
+    'onerror=',
+    'onclick=',
+    'onload=',
+    '<iframe',
+    '<object',
+    '<embed',
+    'data:text/html',
+]
+
+# 将所有模式合并为一个忽略大小写的正则，一次扫描即可匹配全部模式
+_XSS_RE = regex_engine.compile('(?i)' + '|'.join(map(re.escape, XSS_PATTERNS)))
+
+# 最短攻击模式的长度，短于该长度的值不可能命中任何模式
+_XSS_MIN_LENGTH = min(map(len, XSS_PATTERNS))
+
+# 每个攻击模式都至少包含其中一个字符，不含这些字符的值无需进入正则匹配
+_XSS_TRIGGERS = '<:='
+
 
 class XSSProtectionMiddleware(MiddlewareMixin):
     """
@@ -17,11 +47,71 @@ class XSSProtectionMiddleware(MiddlewareMixin):
     
     在响应头中添加额外的安全头，增强XSS防护：
     - X-XSS-Protection: 启用浏览器XSS过滤器
-    - X-Content-Type-Options: 防止MIME类型嗅探
+    - Permissions-Policy: 限制浏览器特性的使用
     - Content-Security-Policy: 内容安全策略
-    - Referrer-Policy: 控制Referer头信息
+    
+    X-Content-Type-Options 和 Referrer-Policy 由Django内置的
+    SecurityMiddleware根据 SECURE_CONTENT_TYPE_NOSNIFF 和
+    SECURE_REFERRER_POLICY 配置添加
     """
     
+    # 固定不变的安全头，(名称, 值) 对
+    SECURITY_HEADERS = (
+        # X-XSS-Protection: 启用浏览器的XSS过滤器
+        # 1; mode=block 表示检测到XSS攻击时阻止页面加载
+        ('X-XSS-Protection', '1; mode=block'),
+        # Permissions-Policy: 控制浏览器特性的使用权限
+        # 禁用不需要的浏览器API，减少攻击面
+        ('Permissions-Policy', (
+            'geolocation=(), '
+            'microphone=(), '
+            'camera=(), '
+            'payment=(), '
+            'usb=(), '
+            'magnetometer=(), '
+            'accelerometer=(), '
+            'gyroscope=()'
+        )),
+    )
+    
+    # CSP指令与settings配置项的对应关系
+    CSP_DIRECTIVES = (
+        ('default-src', 'CSP_DEFAULT_SRC'),
+        ('script-src', 'CSP_SCRIPT_SRC'),
+        ('style-src', 'CSP_STYLE_SRC'),
+        ('img-src', 'CSP_IMG_SRC'),
+        ('font-src', 'CSP_FONT_SRC'),
+        ('connect-src', 'CSP_CONNECT_SRC'),
+        ('frame-ancestors', 'CSP_FRAME_ANCESTORS'),
+        ('base-uri', 'CSP_BASE_URI'),
+        ('form-action', 'CSP_FORM_ACTION'),
+    )
+    
+    # 需要添加CSP头的响应内容类型
+    CSP_CONTENT_TYPES = ('text/html', 'application/xhtml')
+    
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        # settings在运行期间不会变化，CSP策略只需在启动时构建一次
+        self._csp = self._build_csp()
+    
+    def _build_csp(self):
+        """
+        根据settings中的CSP配置构建Content-Security-Policy头的值
+        
+        Returns:
+            CSP策略字符串，未配置CSP_DEFAULT_SRC时返回None
+        """
+        if not hasattr(settings, 'CSP_DEFAULT_SRC'):
+            return None
+        
+        csp_directives = [
+            f"{directive} {' '.join(getattr(settings, name))}"
+            for directive, name in self.CSP_DIRECTIVES
+            if hasattr(settings, name)
+        ]
+        return '; '.join(csp_directives) or None
+    
     def process_response(self, request, response):
         """
         处理响应，添加安全头
@@ -33,70 +123,18 @@ class XSSProtectionMiddleware(MiddlewareMixin):
         Returns:
             添加了安全头的响应对象
         """
-        # X-XSS-Protection: 启用浏览器的XSS过滤器
-        # 1; mode=block 表示检测到XSS攻击时阻止页面加载
-        if not response.get('X-XSS-Protection'):
-            response['X-XSS-Protection'] = '1; mode=block'
-        
-        # X-Content-Type-Options: 防止浏览器进行MIME类型嗅探
-        # nosniff 强制浏览器遵守Content-Type头
-        if not response.get('X-Content-Type-Options'):
-            response['X-Content-Type-Options'] = 'nosniff'
-        
-        # Referrer-Policy: 控制Referer头信息的发送
-        # strict-origin-when-cross-origin 在跨域请求时只发送源信息
-        if not response.get('Referrer-Policy'):
-            response['Referrer-Policy'] = 'strict-origin-when-cross-origin'
-        
-        # Permissions-Policy: 控制浏览器特性的使用权限
-        # 禁用不需要的浏览器API，减少攻击面
-        if not response.get('Permissions-Policy'):
-            response['Permissions-Policy'] = (
-                'geolocation=(), '
-                'microphone=(), '
-                'camera=(), '
-                'payment=(), '
-                'usb=(), '
-                'magnetometer=(), '
-                'accelerometer=(), '
-                'gyroscope=()'
-            )
+        headers = response.headers
+        for name, value in self.SECURITY_HEADERS:
+            headers.setdefault(name, value)
         
         # Content-Security-Policy: 内容安全策略
-        # 从settings中读取CSP配置
-        if hasattr(settings, 'CSP_DEFAULT_SRC') and not response.get('Content-Security-Policy'):
-            csp_directives = []
-            
-            # 构建CSP策略
-            if hasattr(settings, 'CSP_DEFAULT_SRC'):
-                csp_directives.append(f"default-src {' '.join(settings.CSP_DEFAULT_SRC)}")
-            
-            if hasattr(settings, 'CSP_SCRIPT_SRC'):
-                csp_directives.append(f"script-src {' '.join(settings.CSP_SCRIPT_SRC)}")
-            
-            if hasattr(settings, 'CSP_STYLE_SRC'):
-                csp_directives.append(f"style-src {' '.join(settings.CSP_STYLE_SRC)}")
-            
-            if hasattr(settings, 'CSP_IMG_SRC'):
-                csp_directives.append(f"img-src {' '.join(settings.CSP_IMG_SRC)}")
-            
-            if hasattr(settings, 'CSP_FONT_SRC'):
-                csp_directives.append(f"font-src {' '.join(settings.CSP_FONT_SRC)}")
-            
-            if hasattr(settings, 'CSP_CONNECT_SRC'):
-                csp_directives.append(f"connect-src {' '.join(settings.CSP_CONNECT_SRC)}")
-            
-            if hasattr(settings, 'CSP_FRAME_ANCESTORS'):
-                csp_directives.append(f"frame-ancestors {' '.join(settings.CSP_FRAME_ANCESTORS)}")
-            
-            if hasattr(settings, 'CSP_BASE_URI'):
-                csp_directives.append(f"base-uri {' '.join(settings.CSP_BASE_URI)}")
-            
-            if hasattr(settings, 'CSP_FORM_ACTION'):
-                csp_directives.append(f"form-action {' '.join(settings.CSP_FORM_ACTION)}")
-            
-            if csp_directives:
-                response['Content-Security-Policy'] = '; '.join(csp_directives)
+        # 只有HTML文档需要CSP，图片、JSON、文件下载等响应无需携带
+        if (
+            self._csp
+            and headers.get('Content-Type', '').startswith(self.CSP_CONTENT_TYPES)
+            and 'Content-Security-Policy' not in headers
+        ):
+            headers['Content-Security-Policy'] = self._csp
         
         return response
 
@@ -109,19 +147,6 @@ class InputSanitizationMiddleware(MiddlewareMixin):
     警告：这是一个基础实现，不应作为唯一的防护手段
     """
     
-    # 常见的XSS攻击模式
-    XSS_PATTERNS = [
-        '<script',
-        'javascript:',
-        'onerror=',
-        'onclick=',
-        'onload=',
-        '<iframe',
-        '<object',
-        '<embed',
-        'data:text/html',
-    ]
-    
     def process_request(self, request):
         """
         处理请求，检查是否包含明显的XSS攻击模式
@@ -132,28 +157,22 @@ class InputSanitizationMiddleware(MiddlewareMixin):
         Returns:
             None 或 HttpResponse（如果检测到攻击）
         """
-        # 检查GET参数
-        for key, value in request.GET.items():
-            if self._contains_xss_pattern(value):
-                # 记录可疑请求
-                import logging
-                logger = logging.getLogger('security')
-                logger.warning(
-                    f'检测到可疑的XSS攻击尝试 - GET参数 {key}: {value[:100]} '
-                    f'来自IP: {self._get_client_ip(request)}'
-                )
-        
-        # 检查POST参数
+        # 需要检查的参数来源，POST请求额外检查表单参数
+        sources = [('GET', request.GET)]
         if request.method == 'POST':
-            for key, value in request.POST.items():
-                if isinstance(value, str) and self._contains_xss_pattern(value):
-                    # 记录可疑请求
-                    import logging
-                    logger = logging.getLogger('security')
-                    logger.warning(
-                        f'检测到可疑的XSS攻击尝试 - POST参数 {key}: {value[:100]} '
-                        f'来自IP: {self._get_client_ip(request)}'
-                    )
+            sources.append(('POST', request.POST))
+        
+        # 使用lists()以覆盖同名参数的所有取值，发现第一处可疑输入即停止扫描
+        for source, params in sources:
+            for key, values in params.lists():
+                for value in values:
+                    if self._contains_xss_pattern(value):
+                        # 记录可疑请求
+                        logger.warning(
+                            '检测到可疑的XSS攻击尝试 - %s参数 %s: %.100s 来自IP: %s',
+                            source, key, value, self._get_client_ip(request)
+                        )
+                        return None
         
         return None
     
@@ -167,11 +186,11 @@ class InputSanitizationMiddleware(MiddlewareMixin):
         Returns:
             True表示包含可疑模式，False表示安全
         """
-        if not isinstance(value, str):
+        if not isinstance(value, str) or len(value) < _XSS_MIN_LENGTH:
             return False
-        
-        value_lower = value.lower()
-        return any(pattern in value_lower for pattern in self.XSS_PATTERNS)
+        if not any(char in value for char in _XSS_TRIGGERS):
+            return False
+        return _XSS_RE.search(value) is not None
     
     def _get_client_ip(self, request):
         """
@@ -185,8 +204,7 @@ class InputSanitizationMiddleware(MiddlewareMixin):
         """
         x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
         if x_forwarded_for:
-            ip = x_forwarded_for.split(',')[0]
-        else:
-            ip = request.META.get('REMOTE_ADDR')
-        return ip
+            # 只取第一个代理地址，无需拆分整个代理链
+            return x_forwarded_for.partition(',')[0].strip()
+        return request.META.get('REMOTE_ADDR')
 
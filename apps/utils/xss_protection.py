@@ -14,8 +14,68 @@ XSS攻击防护工具模块
 
 import re
 import html
+import threading
 from typing import Optional
-from django.utils.html import escape, strip_tags
+from django.utils.html import strip_tags
+
+try:
+    # XSS检测使用的正则引擎，供其他模块编译扫描用的模式
+    # google-re2保证线性时间匹配，不受回溯型ReDoS影响
+    # 两种引擎中\w、\s的含义不同（RE2仅匹配ASCII），
+    # 因此用regex_engine编译的模式只使用显式的字符类，保证结果与引擎无关
+    import re2 as regex_engine
+except ImportError:  # 未安装google-re2时使用标准库re
+    regex_engine = re
+
+try:
+    from bleach.sanitizer import Cleaner
+except ImportError:  # 未安装bleach时退回到移除全部标签
+    Cleaner = None
+
+
+# 常见的XSS危险字符序列，合并为一个正则，每次扫描同时移除全部模式
+_DANGEROUS_RE = regex_engine.compile(
+    r'(?i)javascript:'
+    r'|on[A-Za-z0-9_]+[\t\n\f\r ]*='  # 事件处理器 (onclick=, onerror=, etc.)
+    r'|<[\t\n\f\r ]*(?:script|iframe|object|embed|link|style)'
+    r'|expression[\t\n\f\r ]*\(',  # CSS expression
+)
+
+# clean_input重复移除危险序列的最大扫描次数
+_MAX_CLEAN_PASSES = 9
+
+# 不安全内容的检测规则，每个命名分组对应一类风险
+_UNSAFE_RE = regex_engine.compile(
+    r'(?i)<(?P<tag>script|iframe|object|embed|link|style)'  # 危险的标签
+    r'|(?P<event>on(?:click|error|load|mouseover|focus|blur))'  # 事件处理器
+    r'|(?P<js>javascript:)'  # JavaScript伪协议
+    r'|(?P<data>data:(?:text/html|image/svg\+xml))',  # 危险的data URI
+)
+
+# JavaScript字符串中需要转义的单个字符及其转义结果，由str.translate在C层一次完成
+_JS_ESCAPE_TABLE = str.maketrans({
+    '\\': '\\\\',  # 反斜杠
+    '"': '\\"',    # 双引号
+    "'": "\\'",    # 单引号
+    '\n': '\\n',   # 换行符
+    '\r': '\\r',   # 回车符
+    '\t': '\\t',   # 制表符
+})
+
+_html_escape = html.escape
+
+# sanitize_html默认允许的标签
+DEFAULT_ALLOWED_TAGS = frozenset(['p', 'br', 'strong', 'em', 'u', 'b', 'i'])
+
+# bleach的Cleaner不是线程安全的，每个线程按允许的标签集合缓存各自的实例
+_cleaners = threading.local()
+_MAX_CLEANERS_PER_THREAD = 8
+
+# 危险的URL协议
+_DANGEROUS_SCHEMES = ('javascript:', 'data:', 'vbscript:', 'file:')
+
+# 允许的安全协议（含相对路径和锚点）
+_SAFE_SCHEMES = ('http://', 'https://', 'mailto:', 'tel:', '/', '#')
 
 
 def escape_html(text: str) -> str:
@@ -34,9 +94,12 @@ def escape_html(text: str) -> str:
         >>> escape_html('<script>alert("XSS")</script>')
         '&lt;script&gt;alert(&quot;XSS&quot;)&lt;/script&gt;'
     """
-    if not text:
-        return ""
-    return html.escape(str(text), quote=True)
+    if not isinstance(text, str):
+        text = '' if text is None else str(text)
+    elif not ('&' in text or '<' in text or '>' in text or '"' in text or "'" in text):
+        # 不含任何特殊字符时直接返回原字符串
+        return text
+    return _html_escape(text, quote=True)
 
 
 def clean_input(text: str, max_length: Optional[int] = None) -> str:
@@ -63,20 +126,16 @@ def clean_input(text: str, max_length: Optional[int] = None) -> str:
     cleaned = strip_tags(str(text))
     
     # 移除常见的XSS危险字符序列
-    dangerous_patterns = [
-        r'javascript:',
-        r'on\w+\s*=',  # 事件处理器 (onclick=, onerror=, etc.)
-        r'<\s*script',
-        r'<\s*iframe',
-        r'<\s*object',
-        r'<\s*embed',
-        r'<\s*link',
-        r'<\s*style',
-        r'expression\s*\(',  # CSS expression
-    ]
-    
-    for pattern in dangerous_patterns:
-        cleaned = re.sub(pattern, '', cleaned, flags=re.IGNORECASE)
+    # 移除后可能拼接出新的危险序列，因此重复扫描，但限制扫描次数，
+    # 避免嵌套构造的输入使清理耗时随嵌套层数增长
+    for _ in range(_MAX_CLEAN_PASSES):
+        cleaned, count = _DANGEROUS_RE.subn('', cleaned)
+        if not count:
+            break
+    else:
+        # 达到扫描次数上限仍有危险序列，视为恶意输入
+        if _DANGEROUS_RE.search(cleaned):
+            return ""
     
     # 限制长度
     if max_length and len(cleaned) > max_length:
@@ -85,6 +144,28 @@ def clean_input(text: str, max_length: Optional[int] = None) -> str:
     return cleaned.strip()
 
 
+def _get_cleaner(allowed_tags: frozenset) -> "Cleaner":
+    """
+    获取当前线程中与允许标签集合对应的Cleaner，不存在时创建
+    
+    Args:
+        allowed_tags: 允许的HTML标签集合
+        
+    Returns:
+        可复用的bleach Cleaner实例
+    """
+    cache = getattr(_cleaners, 'cache', None)
+    if cache is None:
+        cache = _cleaners.cache = {}
+    
+    cleaner = cache.get(allowed_tags)
+    if cleaner is None:
+        if len(cache) >= _MAX_CLEANERS_PER_THREAD:
+            cache.clear()
+        cleaner = cache[allowed_tags] = Cleaner(tags=allowed_tags, strip=True)
+    return cleaner
+
+
 def sanitize_html(text: str, allowed_tags: Optional[list] = None) -> str:
     """
     清理HTML内容，只保留安全的标签和属性
@@ -93,23 +174,25 @@ def sanitize_html(text: str, allowed_tags: Optional[list] = None) -> str:
     
     Args:
         text: 包含HTML的文本
-        allowed_tags: 允许的HTML标签列表，默认为['p', 'br', 'strong', 'em', 'u']
+        allowed_tags: 允许的HTML标签列表，默认为DEFAULT_ALLOWED_TAGS
         
     Returns:
         清理后的安全HTML
         
     Note:
-        这是一个基础实现，对于复杂的富文本场景，建议使用专业库如bleach
+        安装了bleach时使用bleach过滤，保留允许的标签；
+        否则退回到移除所有标签
     """
     if not text:
         return ""
     
+    if Cleaner is None:
+        return strip_tags(str(text))
+    
     if allowed_tags is None:
-        allowed_tags = ['p', 'br', 'strong', 'em', 'u', 'b', 'i']
+        allowed_tags = DEFAULT_ALLOWED_TAGS
     
-    # 对于简单场景，直接移除所有标签
-    # 如需支持富文本，建议使用bleach库
-    return strip_tags(str(text))
+    return _get_cleaner(frozenset(allowed_tags)).clean(str(text))
 
 
 def validate_url(url: str) -> bool:
@@ -134,22 +217,8 @@ def validate_url(url: str) -> bool:
     # 移除空白字符
     url = url.strip().lower()
     
-    # 检查危险的协议
-    dangerous_protocols = [
-        'javascript:',
-        'data:',
-        'vbscript:',
-        'file:',
-    ]
-    
-    for protocol in dangerous_protocols:
-        if url.startswith(protocol):
-            return False
-    
-    # 只允许http, https, mailto, tel等安全协议
-    safe_protocols = ['http://', 'https://', 'mailto:', 'tel:', '/', '#']
-    
-    return any(url.startswith(protocol) for protocol in safe_protocols)
+    # 拒绝危险的协议，只允许http, https, mailto, tel等安全协议
+    return not url.startswith(_DANGEROUS_SCHEMES) and url.startswith(_SAFE_SCHEMES)
 
 
 def escape_js_string(text: str) -> str:
@@ -169,17 +238,8 @@ def escape_js_string(text: str) -> str:
     if not text:
         return ""
     
-    # 转义特殊字符
-    text = str(text)
-    text = text.replace('\\', '\\\\')  # 反斜杠
-    text = text.replace('"', '\\"')    # 双引号
-    text = text.replace("'", "\\'")    # 单引号
-    text = text.replace('\n', '\\n')   # 换行符
-    text = text.replace('\r', '\\r')   # 回车符
-    text = text.replace('\t', '\\t')   # 制表符
-    text = text.replace('</', '<\\/')  # 闭合script标签
-    
-    return text
+    # 先转义单个特殊字符，再处理闭合script标签
+    return str(text).translate(_JS_ESCAPE_TABLE).replace('</', '<\\/')
 
 
 def is_safe_content(text: str) -> tuple[bool, Optional[str]]:
@@ -201,27 +261,15 @@ def is_safe_content(text: str) -> tuple[bool, Optional[str]]:
     if not text:
         return True, None
     
-    text_lower = str(text).lower()
-    
-    # 检测危险的标签
-    dangerous_tags = ['script', 'iframe', 'object', 'embed', 'link', 'style']
-    for tag in dangerous_tags:
-        if f'<{tag}' in text_lower:
-            return False, f'包含{tag}标签'
-    
-    # 检测事件处理器
-    event_handlers = ['onclick', 'onerror', 'onload', 'onmouseover', 'onfocus', 'onblur']
-    for event in event_handlers:
-        if event in text_lower:
-            return False, f'包含事件处理器{event}'
+    match = _UNSAFE_RE.search(str(text))
+    if match is None:
+        return True, None
     
-    # 检测JavaScript伪协议
-    if 'javascript:' in text_lower:
+    kind = match.lastgroup
+    if kind == 'tag':
+        return False, f'包含{match.group(kind).lower()}标签'
+    if kind == 'event':
+        return False, f'包含事件处理器{match.group(kind).lower()}'
+    if kind == 'js':
         return False, '包含JavaScript伪协议'
-    
-    # 检测data URI
-    if 'data:text/html' in text_lower or 'data:image/svg+xml' in text_lower:
-        return False, '包含危险的data URI'
-    
-    return True, None
-
+    return False, '包含危险的data URI'
@@ -154,6 +154,10 @@ SECURE_BROWSER_XSS_FILTER = True
 # 防止浏览器猜测内容类型，强制使用Content-Type头中声明的类型
 SECURE_CONTENT_TYPE_NOSNIFF = True
 
+# Referer头策略，由SecurityMiddleware添加
+# strict-origin-when-cross-origin 在跨域请求时只发送源信息
+SECURE_REFERRER_POLICY = 'strict-origin-when-cross-origin'
+
 # Content Security Policy (CSP) - 内容安全策略
 # 限制资源加载来源，防止XSS攻击
 # 注意：生产环境应该更严格地配置CSP